@@ -1,8 +1,16 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request, HTTPException
-from pydantic import BaseModel, validator
-from datetime import datetime, timedelta
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import Response
+from pydantic import AliasChoices, BaseModel, ConfigDict, Field, field_validator
+from datetime import date, timedelta
+from typing import Iterator, List, Literal
+import asyncio
 import logging
-import json
+import logging.config
+import orjson
+import os
+import time
 
 from agent.helpers import (
     get_note_from_db,
@@ -10,179 +18,274 @@ from agent.helpers import (
     search_from_query,
     save_user_info,
     get_latest_user_info,
-    get_noaa_station_data,
-    get_tide_predictions
+    get_tide_predictions,
+    get_station_id,
+    match_location,
+    init_clients,
+    close_clients
 )
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
+# Configure logging; LOG_LEVEL sets the root level (default INFO)
+LOGGING_CONFIG = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "formatters": {
+        "default": {"format": "%(levelname)s:%(name)s:%(message)s"}
+    },
+    "handlers": {
+        "console": {"class": "logging.StreamHandler", "formatter": "default"}
+    },
+    "root": {"level": os.getenv("LOG_LEVEL", "INFO"), "handlers": ["console"]}
+}
+logging.config.dictConfig(LOGGING_CONFIG)
 logger = logging.getLogger(__name__)
 
-app = FastAPI()
+WELCOME_MESSAGE = (
+    "Welcome! I'm Grandpa Spuds Oakley, your friendly AI fishing guide. Please share your first name and where you'd like to go fishing. "
+    "I'll help you find the best times to catch striped bass based on moon phases and tides!"
+)
+TEST_ROUTE_MESSAGE = (
+    "Hello, We are going to tell ya when the best times to fish for striped bass are based on the moon and the tides if that's ok with you"
+)
+# /user/info greeting, split around the name and location slots
+_GREET_A = "Hey "
+_GREET_B = "! Great to meet you. I know "
+_GREET_C = (
+    " well - that's a fine spot for striped bass fishing. "
+    "Let me help you figure out the best times to fish there based on the moon and tides."
+)
+PRO_TIP = (
+    "\nPro tip from Grandpa Spuds: Striped bass often feed most actively during tide changes, "
+    "especially during the first two hours of an incoming tide or the last two hours of an outgoing tide. "
+    "The low-light periods around dawn and dusk combined with these tide times are your best bet!"
+)
 
-class UserInfo(BaseModel):
-    first_name: str
-    fishing_location: str
+# Static responses are serialized once at import time
+WELCOME_BODY = orjson.dumps({"message": WELCOME_MESSAGE})
+TEST_ROUTE_BODY = orjson.dumps({"message": TEST_ROUTE_MESSAGE})
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await init_clients()
+    yield
+    await close_clients()
+
+app = FastAPI(lifespan=lifespan)
+# Forecasts and search results are long English text; compress anything over 500 bytes
+app.add_middleware(GZipMiddleware, minimum_size=500)
+
+SupportedLocation = Literal[
+    "Cape Cod",
+    "Boston Harbor",
+    "New York Harbor",
+    "Chesapeake Bay",
+    "Long Island Sound"
+]
 
-    class Config:
-        json_schema_extra = {
+class UserInfo(BaseModel):
+    model_config = ConfigDict(
+        str_strip_whitespace=True,
+        json_schema_extra={
             "example": {
                 "first_name": "John",
                 "fishing_location": "Cape Cod"
             }
         }
+    )
+
+    # The agent's tool call sends "name" and "location"
+    first_name: str = Field(validation_alias=AliasChoices('first_name', 'name'))
+    fishing_location: SupportedLocation = Field(
+        validation_alias=AliasChoices('fishing_location', 'location')
+    )
 
-    @validator('first_name')
-    def validate_first_name(cls, v):
-        if not v.strip():
+    @field_validator('first_name')
+    @classmethod
+    def validate_first_name(cls, v: str) -> str:
+        if not v:
             raise ValueError('First name cannot be empty')
-        return v.strip()
+        return v
 
-    @validator('fishing_location')
-    def validate_fishing_location(cls, v):
-        if not v.strip():
-            raise ValueError('Fishing location cannot be empty')
-        return v.strip()
+    @field_validator('fishing_location', mode='before')
+    @classmethod
+    def normalize_fishing_location(cls, v):
+        # Map variants like "cape cod, ma" onto the canonical name; anything
+        # unsupported is left as-is and rejected by the Literal check
+        if isinstance(v, str):
+            key = match_location(v)
+            if key:
+                return key.title()
+        return v
+
+class BatchRequest(BaseModel):
+    model_config = ConfigDict(
+        json_schema_extra={
+            "example": {
+                "names": ["John", "Jane"]
+            }
+        }
+    )
+
+    # Each name fans out into its own user lookup, so keep batches bounded
+    names: List[str] = Field(max_length=50)
 
 @app.get("/")
-def read_root() -> dict[str, str]:
-    return {
-        "message": "Welcome! I'm Grandpa Spuds Oakley, your friendly AI fishing guide. Please share your first name and where you'd like to go fishing. I'll help you find the best times to catch striped bass based on moon phases and tides!"
-    }
+async def read_root() -> Response:
+    return Response(content=WELCOME_BODY, media_type="application/json")
 
 @app.post("/user/info")
-async def collect_user_info(request: Request) -> dict[str, str]:
-    try:
-        # Get the raw request data and log it
-        request_body = await request.json()
-        logger.info(f"Received request body: {json.dumps(request_body)}")
-        
-        # Extract first name and fishing location from request body
-        first_name = request_body.get('name', '')
-        fishing_location = request_body.get('location', '')
-        
-        logger.info(f"Extracted first_name: {first_name}, fishing_location: {fishing_location}")
-        
-        # Validate the data
-        if not first_name or not fishing_location:
-            logger.error("Missing required fields")
-            raise HTTPException(
-                status_code=400,
-                detail="Please provide both your first name and fishing location"
-            )
-        
-        # Try to save user info to database
-        logger.info("Attempting to save user info to database")
-        save_result = save_user_info(first_name, fishing_location)
-        logger.info(f"Save result: {save_result}")
-        
-        if save_result:
-            response_message = f"Hey {first_name}! Great to meet you. I know {fishing_location} well - that's a fine spot for striped bass fishing. Let me help you figure out the best times to fish there based on the moon and tides."
-            logger.info(f"Successfully processed request. Returning message: {response_message}")
-            return {
-                "message": response_message
-            }
-        else:
-            logger.error("Failed to save user information")
-            raise HTTPException(
-                status_code=500,
-                detail="Failed to save user information to database"
-            )
-    except json.JSONDecodeError as e:
-        logger.error(f"JSON decode error: {str(e)}")
-        raise HTTPException(
-            status_code=400,
-            detail="Invalid JSON format in request body"
-        )
-    except ValueError as e:
-        logger.error(f"Validation error: {str(e)}")
-        raise HTTPException(
-            status_code=400,
-            detail=str(e)
-        )
-    except Exception as e:
-        logger.error(f"Unexpected error: {str(e)}")
-        raise HTTPException(
-            status_code=500,
-            detail=f"An unexpected error occurred while processing your information. Please try again."
-        )
-
-@app.get("/test/route")
-def read_root() -> dict[str, str]:
+async def collect_user_info(user_info: UserInfo) -> dict[str, str]:
+    # Validation (required fields, empty names, supported locations) happens in
+    # UserInfo before this runs; invalid payloads get FastAPI's 422 response
+    first_name, fishing_location = user_info.first_name, user_info.fishing_location
+    
+    # Queue the save; the reply doesn't depend on the write completing
+    await save_user_info(first_name, fishing_location)
+    logger.info("Queued user info (name_len=%d)", len(first_name))
+    
+    response_message = _GREET_A + first_name + _GREET_B + fishing_location + _GREET_C
     return {
-        "message": "Hello, We are going to tell ya when the best times to fish for striped bass are based on the moon and the tides if that's ok with you"
+        "message": response_message
     }
 
+@app.get("/test/route")
+async def test_route() -> Response:
+    return Response(content=TEST_ROUTE_BODY, media_type="application/json")
+
 @app.post("/agent/take-note")
 async def take_note(request: Request) -> dict[str, str]:
-    request_body = await request.json()
-    if save_note(request_body['note']):
+    request_body = orjson.loads(await request.body())
+    if await save_note(request_body['note']):
         return {"status": "success"}
     else:
         return {"status": "error"}
 
 @app.post("/agent/search")
 async def search(request: Request) -> dict[str, str]:
-    request_body = await request.json()
-    result = search_from_query(request_body['search_query'])
+    request_body = orjson.loads(await request.body())
+    result = await search_from_query(request_body['search_query'])
     return {
         "result": result
     }
 
 @app.get("/agent/get-note")
 async def get_note(request: Request) -> dict[str, str]:
-    note = get_note_from_db()
+    note = await get_note_from_db()
 
     return {
         "note": note
     }
 
+# (minute, start_date, end_date) of the last computed tide date range
+_date_cache: tuple[int, str, str] = (-1, "", "")
+
+def tide_date_range() -> tuple[str, str]:
+    """Start and end dates for the next 3 days of tide predictions."""
+    global _date_cache
+    # Re-formatted at most once a minute, so the range rolls over shortly after midnight
+    minute = int(time.time() // 60)
+    if _date_cache[0] != minute:
+        today = date.today()
+        _date_cache = (minute, today.strftime("%Y%m%d"), (today + timedelta(days=3)).strftime("%Y%m%d"))
+    return _date_cache[1], _date_cache[2]
+
+def unsupported_location_message(first_name: str, fishing_location: str) -> str:
+    return (
+        f"Hey {first_name}, I don't have tide information for {fishing_location} yet. "
+        "I currently support Cape Cod, Boston Harbor, New York Harbor, Chesapeake Bay, and Long Island Sound. "
+        "Please try one of these locations!"
+    )
+
+def tides_unavailable_message(first_name: str) -> str:
+    return f"Sorry {first_name}, I'm having trouble getting the tide predictions right now. Please try again later!"
+
+def format_tide_time(t: str) -> str:
+    """Format a NOAA "YYYY-MM-DD HH:MM" timestamp as "HH:MM AM/PM"."""
+    hour = int(t[11:13])
+    meridiem = "AM" if hour < 12 else "PM"
+    return f"{hour % 12 or 12:02d}:{t[14:16]} {meridiem}"
+
+def forecast_parts(first_name: str, fishing_location: str, tide_data: dict) -> Iterator[str]:
+    # Format a fishing-focused response, one line at a time
+    tides = tide_data["predictions"]
+    next_tides = tides[:4]  # Get next 2 high and low tides
+    
+    yield (
+        f"Hey {first_name}! Here's your striped bass fishing forecast for {fishing_location}:\n\n"
+        "Grandpa Spuds here, and let me tell you about the next few tides:\n"
+    )
+    for tide in next_tides:
+        yield f"- {tide['type']} tide at {format_tide_time(tide['t'])} ({tide['v']} ft)"
+    yield PRO_TIP
+
+def format_forecast(first_name: str, fishing_location: str, tide_data: dict) -> str:
+    return "\n".join(forecast_parts(first_name, fishing_location, tide_data))
+
 @app.get("/fishing-conditions/{first_name}")
-async def get_fishing_conditions(first_name: str) -> dict:
+async def get_fishing_conditions(first_name: str) -> dict[str, str]:
     # Get user's saved location
-    user_info = get_latest_user_info(first_name)
+    user_info = await get_latest_user_info(first_name)
     if not user_info:
-        raise HTTPException(status_code=404, message=f"No information found for {first_name}")
+        raise HTTPException(status_code=404, detail=f"No information found for {first_name}")
     
-    # Get NOAA station data for the location
-    station_data = get_noaa_station_data(user_info["fishing_location"])
-    if not station_data:
+    # The station ID is resolved locally, so the tide predictions for the next
+    # 3 days are the only NOAA call needed
+    station_id = get_station_id(user_info["fishing_location"])
+    if not station_id:
         return {
-            "message": f"Hey {first_name}, I don't have tide information for {user_info['fishing_location']} yet. "
-                      "I currently support Cape Cod, Boston Harbor, New York Harbor, Chesapeake Bay, and Long Island Sound. "
-                      "Please try one of these locations!"
+            "message": unsupported_location_message(first_name, user_info["fishing_location"])
         }
     
-    # Get tide predictions for next 3 days
-    start_date = datetime.now().strftime("%Y%m%d")
-    end_date = (datetime.now() + timedelta(days=3)).strftime("%Y%m%d")
+    start_date, end_date = tide_date_range()
+    tide_data = await get_tide_predictions(station_id, start_date, end_date)
     
-    tide_data = get_tide_predictions(
-        station_data["stations"][0]["id"],
-        start_date,
-        end_date
-    )
-    
-    if not tide_data or "predictions" not in tide_data:
+    if not tide_data:
         return {
-            "message": f"Sorry {first_name}, I'm having trouble getting the tide predictions right now. Please try again later!"
+            "message": tides_unavailable_message(first_name)
         }
     
-    # Format a fishing-focused response
-    tides = tide_data["predictions"]
-    next_tides = tides[:4]  # Get next 2 high and low tides
-    
-    response_message = (
-        f"Hey {first_name}! Here's your striped bass fishing forecast for {user_info['fishing_location']}:\n\n"
-        "Grandpa Spuds here, and let me tell you about the next few tides:\n\n"
+    return {
+        "message": format_forecast(first_name, user_info["fishing_location"], tide_data)
+    }
+
+@app.post("/fishing-conditions/batch")
+async def get_fishing_conditions_batch(batch: BatchRequest) -> dict[str, dict[str, str]]:
+    names = list(dict.fromkeys(batch.names))
+    users = await asyncio.gather(*(get_latest_user_info(name) for name in names))
+
+    # One tide fetch per unique station, all in flight at once
+    locations = list(dict.fromkeys(user["fishing_location"] for user in users if user))
+    station_ids = list(dict.fromkeys(filter(None, map(get_station_id, locations))))
+    start_date, end_date = tide_date_range()
+    tide_results = await asyncio.gather(
+        *(get_tide_predictions(station_id, start_date, end_date) for station_id in station_ids)
+    )
+    tides = dict(zip(station_ids, tide_results))
+
+    results = {}
+    for name, user_info in zip(names, users):
+        if not user_info:
+            results[name] = f"No information found for {name}"
+            continue
+        station_id = get_station_id(user_info["fishing_location"])
+        if not station_id:
+            results[name] = unsupported_location_message(name, user_info["fishing_location"])
+            continue
+        tide_data = tides[station_id]
+        if not tide_data:
+            results[name] = tides_unavailable_message(name)
+            continue
+        results[name] = format_forecast(name, user_info["fishing_location"], tide_data)
+
+    return {"results": results}
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(
+        app,
+        host="0.0.0.0",
+        port=int(os.getenv("PORT", "8000")),
+        loop="uvloop",
+        http="httptools"
     )
-    
-    for tide in next_tides:
-        tide_time = datetime.strptime(tide["t"], "%Y-%m-%d %H:%M")
-        response_message += f"- {tide['type']} tide at {tide_time.strftime('%I:%M %p')} ({tide['v']} ft)\n"
-    
-    response_message += "\nPro tip from Grandpa Spuds: Striped bass often feed most actively during tide changes, "
-    response_message += "especially during the first two hours of an incoming tide or the last two hours of an outgoing tide. "
-    response_message += "The low-light periods around dawn and dusk combined with these tide times are your best bet!"
-    
-    return {"message": response_message}
@@ -1,40 +1,262 @@
-from pymongo.synchronous.mongo_client import MongoClient
-
-
-from typing import Any, Dict, Optional
-
-
+import asyncio
+import functools
+import logging
 import os
+import re
+import weakref
+from typing import Any, Dict, Optional
+from cachetools import TTLCache
 from dotenv import load_dotenv
-from pymongo import DESCENDING, MongoClient
-import requests
-import datetime
+from bson.datetime_ms import DatetimeMS
+from pymongo import DESCENDING, AsyncMongoClient
+from pymongo.errors import PyMongoError
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+import httpx
+import orjson
+import time
 
 _ = load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 MONGO_URI: str | None = os.getenv("MONGODB_URI")    
-client = MongoClient(MONGO_URI)
-db = client['eleven_labs_assistant']
-notes_collection = db['notes']
-users_collection = db['users']
+# Mongo connection pool: keep 10 warm connections, cap fan-out at 50, and drop
+# connections idle for 5 minutes.
+MONGO_MIN_POOL_SIZE = 10
+MONGO_MAX_POOL_SIZE = 50
+MONGO_MAX_IDLE_TIME_MS = 300_000
+# Fail fast when no server is reachable instead of holding requests for 30 s
+MONGO_SERVER_SELECTION_TIMEOUT_MS = 5_000
+# Optional; when unset, NOAA responses are simply not cached.
+REDIS_URL: str | None = os.getenv("REDIS_URL")
+
+# Process-wide clients, created once by the app lifespan and reused by every
+# request so the hot path never pays connection setup.
+client: Optional[AsyncMongoClient] = None
+notes_collection = None
+users_collection = None
+http_client: Optional[httpx.AsyncClient] = None
+redis_client: Optional[Redis] = None
+_ping_task: Optional[asyncio.Task] = None
+
+async def init_clients() -> None:
+    global client, notes_collection, users_collection, http_client, redis_client, _ping_task
+    client = AsyncMongoClient(
+        MONGO_URI,
+        minPoolSize=MONGO_MIN_POOL_SIZE,
+        maxPoolSize=MONGO_MAX_POOL_SIZE,
+        maxIdleTimeMS=MONGO_MAX_IDLE_TIME_MS,
+        serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        retryWrites=True
+    )
+    db = client['eleven_labs_assistant']
+    notes_collection = db['notes']
+    users_collection = db['users']
+    # Ping in the background so the worker starts serving immediately instead
+    # of waiting up to the server selection timeout on a cold cluster
+    _ping_task = asyncio.create_task(_ping_mongo())
+    # HTTP/2 multiplexes concurrent NOAA requests over one connection per host
+    http_client = httpx.AsyncClient(
+        timeout=10.0,
+        http2=True,
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=20)
+    )
+    if REDIS_URL:
+        redis_client = Redis.from_url(REDIS_URL)
+    _start_user_info_writer()
+
+async def _ping_mongo() -> None:
+    try:
+        await client.admin.command("ping")
+    except PyMongoError:
+        logger.warning("MongoDB ping failed at startup", exc_info=True)
+        return
+    logger.info("MongoDB connected: %s", get_db_stats())
+
+async def close_clients() -> None:
+    global client, http_client, redis_client, _ping_task
+    if _ping_task is not None:
+        _ping_task.cancel()
+        _ping_task = None
+    await _stop_user_info_writer()
+    if redis_client is not None:
+        await redis_client.aclose()
+        redis_client = None
+    if http_client is not None:
+        await http_client.aclose()
+        http_client = None
+    if client is not None:
+        await client.close()
+        client = None
+
+def get_db_stats() -> Dict[str, Any]:
+    """
+    Summarize the Mongo client's view of the cluster and its pool settings.
+    """
+    if client is None:
+        return {"connected": False}
+    topology = client.topology_description
+    return {
+        "connected": True,
+        "topology_type": topology.topology_type_name,
+        "servers": [
+            {
+                "address": f"{host}:{port}",
+                "type": server.server_type_name,
+                "round_trip_time_ms": (
+                    round(server.round_trip_time * 1000, 2)
+                    if server.round_trip_time is not None else None
+                )
+            }
+            for (host, port), server in topology.server_descriptions().items()
+        ],
+        "min_pool_size": MONGO_MIN_POOL_SIZE,
+        "max_pool_size": MONGO_MAX_POOL_SIZE
+    }
+
+async def _redis_get(key: str) -> Optional[Any]:
+    if redis_client is None:
+        return None
+    try:
+        cached = await redis_client.get(key)
+    except RedisError:
+        logger.warning("Redis get failed for %s", key, exc_info=True)
+        return None
+    return orjson.loads(cached) if cached is not None else None
+
+async def _redis_set(key: str, ttl: int, value: Any) -> None:
+    if redis_client is None:
+        return
+    try:
+        await redis_client.setex(key, ttl, orjson.dumps(value))
+    except RedisError:
+        logger.warning("Redis set failed for %s", key, exc_info=True)
+
+# Loads currently in flight, keyed by cache key, so concurrent misses share one
+# Redis lookup / upstream call instead of each issuing their own.
+_inflight: Dict[str, asyncio.Task] = {}
+
+async def _single_flight(key: str, load) -> Any:
+    task = _inflight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(load())
+        _inflight[key] = task
+        task.add_done_callback(lambda _: _inflight.pop(key, None))
+    # Shield so one caller disconnecting doesn't cancel the load for the rest
+    return await asyncio.shield(task)
+
+def acache(prefix: str, ttl: int, local_ttl: Optional[int] = None, local_maxsize: int = 128):
+    """
+    Cache a coroutine's JSON-serializable result in Redis for `ttl` seconds.
+    If `local_ttl` is given, results are also kept in an in-process TTL LRU that
+    is checked before Redis, so warm keys never leave the process.
+    The key is built from the prefix and the lowercased positional arguments.
+    Concurrent misses for the same key are coalesced into a single load.
+    None results are not cached, and Redis errors fall through to the call.
+    """
+    def decorator(func):
+        local = TTLCache(maxsize=local_maxsize, ttl=local_ttl) if local_ttl else None
 
-def save_user_info(first_name: str, fishing_location: str) -> bool:
-    result = users_collection.insert_one({
+        @functools.wraps(func)
+        async def wrapper(*args):
+            key = ":".join([prefix, *(str(arg).strip().lower() for arg in args)])
+            if local is not None:
+                result = local.get(key)
+                if result is not None:
+                    return result
+
+            async def load():
+                result = await _redis_get(key)
+                if result is None:
+                    result = await func(*args)
+                    if result is not None:
+                        await _redis_set(key, ttl, result)
+                return result
+
+            result = await _single_flight(key, load)
+            if result is not None and local is not None:
+                local[key] = result
+            return result
+        return wrapper
+    return decorator
+
+# User info is written off the request path: /user/info queues the record and a
+# background task flushes the queue with insert_many every 50 ms or 100 records.
+USER_INFO_BATCH_SIZE = 100
+USER_INFO_FLUSH_INTERVAL = 0.05
+_user_info_queue: Optional[asyncio.Queue] = None
+_user_info_writer: Optional[asyncio.Task] = None
+
+def _start_user_info_writer() -> None:
+    global _user_info_queue, _user_info_writer
+    _user_info_queue = asyncio.Queue(maxsize=10_000)
+    _user_info_writer = asyncio.create_task(_write_user_info(_user_info_queue))
+
+async def _stop_user_info_writer() -> None:
+    global _user_info_queue, _user_info_writer
+    if _user_info_writer is None:
+        return
+    # None tells the writer to flush what's queued and exit
+    await _user_info_queue.put(None)
+    await _user_info_writer
+    _user_info_queue = None
+    _user_info_writer = None
+
+async def _write_user_info(queue: asyncio.Queue) -> None:
+    loop = asyncio.get_running_loop()
+    while True:
+        doc = await queue.get()
+        if doc is None:
+            return
+        batch = [doc]
+        deadline = loop.time() + USER_INFO_FLUSH_INTERVAL
+        stopping = False
+        while len(batch) < USER_INFO_BATCH_SIZE:
+            try:
+                doc = await asyncio.wait_for(queue.get(), deadline - loop.time())
+            except asyncio.TimeoutError:
+                break
+            if doc is None:
+                stopping = True
+                break
+            batch.append(doc)
+        await _flush_user_info(batch)
+        if stopping:
+            return
+
+async def _flush_user_info(batch: list) -> None:
+    # Catch everything: an escaping error would end the writer task, after which
+    # records would be silently dropped and the queue would eventually fill up
+    try:
+        await users_collection.insert_many(batch, ordered=False)
+    except Exception:
+        logger.error("Failed to save %d user info records", len(batch), exc_info=True)
+    for doc in batch:
+        _user_cache.pop(doc["first_name"], None)
+
+async def save_user_info(first_name: str, fishing_location: str) -> None:
+    """
+    Queue a user info record for the background writer. Only waits if the
+    queue is full.
+    """
+    await _user_info_queue.put({
         "first_name": first_name,
         "fishing_location": fishing_location,
-        "created_at": datetime.datetime.utcnow()
+        # Stored as a BSON date, same as older records, so sorting on
+        # created_at is unchanged; built from epoch ms without a datetime
+        "created_at": DatetimeMS(time.time_ns() // 1_000_000)
     })
-    return bool(result.inserted_id)
 
-def save_note(note: str) -> bool:
-    result = notes_collection.insert_one({"note": note})
+async def save_note(note: str) -> bool:
+    result = await notes_collection.insert_one({"note": note})
     if result.inserted_id:
         return True
     else:
         return False
 
-def get_note_from_db() -> str:
-    last_doc = notes_collection.find_one(sort=[("_id", DESCENDING)])
+async def get_note_from_db() -> str:
+    last_doc = await notes_collection.find_one(sort=[("_id", DESCENDING)])
     if last_doc:
         return last_doc['note']
     else:
@@ -50,13 +272,13 @@ def get_note_from_db() -> str:
 #     // temperature: 0.7
 #   };
 
-def query_perplexity(query: str):
+async def query_perplexity(query: str):
     url = "https://api.perplexity.ai/chat/completions"
 
     
     headers = {
         "Accept": "application/json",
-        "Authorization": f"Bearer {os.getenv("PERPLEXITY_API_KEY")}",
+        "Authorization": f"Bearer {os.getenv('PERPLEXITY_API_KEY')}",
         "Content-Type": "application/json",
     }
     data = {
@@ -68,63 +290,91 @@ def query_perplexity(query: str):
         "max_tokens": 1024,
     }
 
-    response = requests.post(url, headers=headers, json=data)
-    citations = response.json()['citations']
-    output = response.json()['choices'][0]['message']['content']
+    # Completions can take well over the shared client's 10 s default to generate
+    try:
+        response = await http_client.post(
+            url,
+            headers=headers,
+            content=orjson.dumps(data),
+            timeout=httpx.Timeout(10.0, read=60.0)
+        )
+    except httpx.HTTPError:
+        logger.warning("Perplexity request failed", exc_info=True)
+        return None
+    body = orjson.loads(response.content)
+    output = body['choices'][0]['message']['content']
     return output
 
-def search_from_query(note: str) -> str:
-    result = query_perplexity(note)
+async def search_from_query(note: str) -> str:
+    result = await query_perplexity(note)
 
     if result:
         return result
     else:
         return "couldn't find any relevant note"
 
-def get_latest_user_info(first_name: str) -> Optional[Dict]:
-    user = users_collection.find_one(
-        {"first_name": first_name},
-        sort=[("created_at", DESCENDING)]
-    )
+# Saved users change rarely, so recent lookups are kept in-process for a minute.
+# Misses for the same name share one lock so a burst triggers a single query.
+_user_cache: TTLCache = TTLCache(maxsize=1024, ttl=60)
+_user_locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+async def get_latest_user_info(first_name: str) -> Optional[Dict]:
+    user = _user_cache.get(first_name)
+    if user is not None:
+        return user
+
+    lock = _user_locks.get(first_name)
+    if lock is None:
+        lock = _user_locks[first_name] = asyncio.Lock()
+    async with lock:
+        user = _user_cache.get(first_name)
+        if user is not None:
+            return user
+        user = await users_collection.find_one(
+            {"first_name": first_name},
+            {"_id": False},
+            sort=[("created_at", DESCENDING)]
+        )
+        if user is not None:
+            _user_cache[first_name] = user
     return user
 
-def get_noaa_station_data(location: str) -> Optional[Dict]:
+# Simple mapping of locations to NOAA station IDs
+STATION_IDS = {
+    "cape cod": "8447930",  # Woods Hole, MA
+    "boston harbor": "8443970",  # Boston, MA
+    "new york harbor": "8518750",  # The Battery, NY
+    "chesapeake bay": "8575512",  # Baltimore, MD
+    "long island sound": "8516945",  # Kings Point, NY
+}
+
+_STATION_RE = re.compile("|".join(map(re.escape, STATION_IDS)))
+
+def match_location(location: str) -> Optional[str]:
+    """
+    Find the supported location (a STATION_IDS key) mentioned in a free-form
+    location string, e.g. "Cape Cod, MA" -> "cape cod".
     """
-    Get NOAA station data for a given location.
+    # Exact names are a dict hit; otherwise scan once for any supported name
+    location_lower = location.strip().lower()
+    if location_lower in STATION_IDS:
+        return location_lower
+    match = _STATION_RE.search(location_lower)
+    return match.group(0) if match else None
+
+def get_station_id(location: str) -> Optional[str]:
+    """
+    Resolve a free-form location to a NOAA station ID without any I/O.
     For now, we'll use a simple mapping of locations to station IDs.
     In a production environment, this should be replaced with a more sophisticated
     location to station ID mapping system.
     """
-    # Simple mapping of locations to NOAA station IDs
-    station_mapping = {
-        "cape cod": "8447930",  # Woods Hole, MA
-        "boston harbor": "8443970",  # Boston, MA
-        "new york harbor": "8518750",  # The Battery, NY
-        "chesapeake bay": "8575512",  # Baltimore, MD
-        "long island sound": "8516945",  # Kings Point, NY
-    }
-    
-    # Convert location to lowercase and find closest match
-    location_lower = location.lower()
-    station_id = None
-    for key in station_mapping:
-        if key in location_lower:
-            station_id = station_mapping[key]
-            break
-    
-    if not station_id:
-        return None
-    
-    # Make request to NOAA API
-    url = f"https://api.tidesandcurrents.noaa.gov/mdapi/prod/webapi/stations/{station_id}.json"
-    try:
-        response = requests.get(url)
-        response.raise_for_status()
-        return response.json()
-    except requests.RequestException:
-        return None
+    key = match_location(location)
+    return STATION_IDS[key] if key else None
 
-def get_tide_predictions(station_id: str, start_date: str, end_date: str) -> Optional[Dict]:
+# Hi/lo predictions for a date range don't change; keep recent ones in-process too
+@acache("noaa:tides", ttl=60 * 60, local_ttl=15 * 60)
+async def get_tide_predictions(station_id: str, start_date: str, end_date: str) -> Optional[Dict]:
     """
     Get tide predictions for a specific station and date range.
     """
@@ -143,8 +393,11 @@ def get_tide_predictions(station_id: str, start_date: str, end_date: str) -> Opt
     }
     
     try:
-        response = requests.get(url, params=params)
+        response = await http_client.get(url, params=params)
         response.raise_for_status()
-        return response.json()
-    except requests.RequestException:
+        data = orjson.loads(response.content)
+    except (httpx.HTTPError, orjson.JSONDecodeError):
         return None
+    # NOAA reports many failures as a 200 with an "error" object; returning None
+    # keeps those out of the cache
+    return data if "predictions" in data else None